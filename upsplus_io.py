@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+UPSplus v5 shared I2C access
+
+- Opens the SMBus handle and configures both INA219 sensors once.
+- read_sample() returns one reading of the GeeekPi UPSv5 (EP-0136) board,
+  shared by the CSV logger and the Prometheus exporter.
+
+Keep this file next to upsplusv5-battery-logger.py / upsplusv5-prometheus-exporter.py.
+"""
+
+from typing import NamedTuple
+
+import smbus
+from ina219 import INA219, DeviceRangeError
+
+I2C_DEVICE_BUS = 1
+SMB_DEVICE_ADDR = 0x17
+INA_DEVICE_ADDR = 0x40
+INA_BATT_ADDR = 0x45
+
+bus = smbus.SMBus(I2C_DEVICE_BUS)
+ina = INA219(0.00725, busnum=I2C_DEVICE_BUS, address=INA_DEVICE_ADDR)
+ina.configure()
+ina_batteries = INA219(0.005, busnum=I2C_DEVICE_BUS, address=INA_BATT_ADDR)
+ina_batteries.configure()
+
+# Register mirror of the UPS board, indexed by register number and reused for every read
+_buf = bytearray(256)
+
+i2c_errors = 0  # failed read_sample() calls since start-up
+
+
+class ShortReadError(OSError):
+    """A block read returned fewer bytes than requested."""
+
+
+def _read_block(register, length):
+    # A glitching bus can hand back a short block; storing it would shift _buf
+    data = bus.read_i2c_block_data(SMB_DEVICE_ADDR, register, length)
+    if len(data) != length:
+        raise ShortReadError(f"short I2C read at 0x{register:02x}: got {len(data)} of {length} bytes")
+    _buf[register:register + length] = data
+
+
+class Sample(NamedTuple):
+    time_s: int
+    volts_mv: int
+    power_mw: float
+    remaining_pct: int
+    batt_current_ma: float
+    batt_temp_c: int
+
+
+def read_sample():
+    """
+    Read one sample from the UPS board and INA219 sensors.
+    Power and battery current are NaN when the INA219 reports a range error.
+    Raises OSError (including ShortReadError) on I2C bus errors and counts
+    them in i2c_errors.
+    """
+    global i2c_errors
+    try:
+        # Only registers 5..20 and 36..39 are used, so read just those two
+        # windows as block reads instead of 254 single-byte transactions
+        _read_block(5, 16)
+        _read_block(36, 4)
+
+        try:
+            power_mw = ina.power()  # mW
+        except DeviceRangeError:
+            power_mw = float("nan")
+
+        try:
+            batt_current_ma = ina_batteries.current()  # mA
+        except DeviceRangeError:
+            batt_current_ma = float("nan")
+    except OSError:
+        i2c_errors += 1
+        raise
+
+    return Sample(
+        # Time (s) = [39..36]
+        time_s=_buf[39] << 24 | _buf[38] << 16 | _buf[37] << 8 | _buf[36],
+        # Volts (mV) = [6..5]
+        volts_mv=_buf[6] << 8 | _buf[5],
+        power_mw=power_mw,
+        # Remaining % = [20..19]
+        remaining_pct=_buf[20] << 8 | _buf[19],
+        batt_current_ma=batt_current_ma,
+        # Batt Temp (ºC) = [12..11]
+        batt_temp_c=_buf[12] << 8 | _buf[11],
+    )
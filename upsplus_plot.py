@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+UPSplus v5 battery log graphing
+
+- Builds the voltage, Pi wattage, batt%, batt current and batt temp graphs
+  from a CSV written by upsplusv5-battery-logger.py.
+- Kept apart from the logger so graphing needs neither smbus nor an I2C bus.
+
+Run via 'python3 upsplusv5-battery-logger.py file.csv "[label for graph title]"'.
+"""
+
+import sys
+import csv
+from array import array
+from datetime import datetime, timezone
+
+
+def make_graph():
+    # test for matplotlib, then graph file referenced as argument if available
+    try:
+        # check dependencies
+        print("Checking: MatplotLib library installed.")
+        import matplotlib.pyplot as plt
+        from matplotlib.dates import DateFormatter
+
+        # read each (numeric) column into its own array; power/current may be "nan"
+        with open(sys.argv[1], newline='', encoding='utf-8') as file:
+            # every row the logger writes ends in CRLF, so a line without one was cut off mid-write
+            reader = csv.reader(line for line in file if line.endswith('\n'))
+            headers = next(reader)
+            columns = [array('d') for _ in headers]
+            for row in reader:
+                # skip rows cut short or garbled, e.g. the last line written before the battery died
+                if len(row) != len(headers):
+                    continue
+                try:
+                    values = [float(value) for value in row]
+                except ValueError:
+                    continue
+                for column, value in zip(columns, values):
+                    column.append(value)
+        data = dict(zip(headers, columns))
+        times = [datetime.fromtimestamp(t, timezone.utc) for t in data["Time (s)"]]
+
+        # build and save voltage, Pi wattage, batt%, batt current and batt temp graphs
+        plots = [
+            ("Volts (mV)", "Red", "Voltage"),
+            ("Power (mW)", "Green", "Power"),
+            ("Remaining %", "Blue", "Remaining%"),
+            ("Battery Current (mA)", "Blue", "BattCurrent mA"),
+            ("Batt. Temp (ºC)", "Blue", "BattTempºC")]
+        fig, axes = plt.subplots(nrows=len(plots), ncols=1, figsize=(10, 10))
+        for ax, (column, colour, label) in zip(axes, plots):
+            ax.plot(times, data[column], color=colour, label=column)
+            ax.legend()
+            ax.grid(True)
+            ax.set_xlabel("Time (H:M)")
+            ax.xaxis.set_major_formatter(DateFormatter('%H:%M'))
+            ax.set_title("Time/" + label + " plot of " + str(sys.argv[2]))
+
+        plt.tight_layout()
+        plt.savefig("Graphs_full_" + sys.argv[1] + ".png")  # save as png
+
+        print("Graphs saved sucessfully")
+
+    except ImportError:
+        print("Error: Cannot build graph - matplotlib library not installed.")
+        print("")
+        print(
+            "To install dependancies, use 'pip3 install matplotlib'. If you encounter errors over the matplotlib "
+            "dependancy 'numpy', you are probably running Debian Buster on a Pi, and so also need to install OpenBLAS "
+            "('apt-get install libatlas-base-dev")
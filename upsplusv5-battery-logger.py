@@ -7,7 +7,7 @@ Contributors: leandroalbero
 
 Logs uptime, battery voltage, device wattage and battery %remaining from the
 GeeekPi UPSv5 (EP-0136) board, connected to a Raspberry Pi,and writes to a
-timestamped CSV file for optional graphing via Pandas (if installed).
+timestamped CSV file for optional graphing via matplotlib (if installed).
 
 Usage:
 'python3 upspv5-batt-logger.py' - logs to local [timestamp].csv file
@@ -21,91 +21,30 @@ when battery power becomes low, causing power outages.
 Note: "% remaining" is not accurate during charging.
 """
 
+import os
 import sys
 import time
+import atexit
+import signal
 import io
-import csv
+import queue
+import threading
 from datetime import datetime
 
-import smbus
-from ina219 import INA219, DeviceRangeError
-
-I2C_DEVICE_BUS = 1
-SMB_DEVICE_ADDR = 0x17
-INA_DEVICE_ADDR = 0x40
-INA_BATT_ADDR = 0x45
 DELAY = 5  # delay between I2C reads (in seconds)
 STOP_ON_ERR = 0  # stop logging on bus read error
+MAX_BACKOFF = 60  # longest wait between retries after repeated bus read errors (in seconds)
+FLUSH_EVERY = 12  # write and fsync rows to the CSV file in chunks of N samples (12 = 1 min)
+QUEUE_SIZE = 64  # rows buffered for the writer thread before sampling blocks
 
 now = datetime.now()
 T = now.strftime("%Y-%m-%d_%H%M%S")
 CSV_FILE = "batt_log_" + T + ".csv"
-
-bus = smbus.SMBus(I2C_DEVICE_BUS)
-ina = INA219(0.00725, busnum=I2C_DEVICE_BUS, address=INA_DEVICE_ADDR)
-ina.configure()
-ina_batteries = INA219(0.005, busnum=I2C_DEVICE_BUS, address=INA_BATT_ADDR)
-ina_batteries.configure()
-
-
-def make_graph():
-    # test for pandas, then graph file referenced as argument if available
-    try:
-        # check dependencies
-        print("Checking: Pandas library installed.")
-        import pandas as pd
-        print("Checking: MatplotLib library installed.")
-        import matplotlib.pyplot as plt
-        from matplotlib.dates import DateFormatter
-
-        # build and save voltage graph
-        df = pd.read_csv(sys.argv[1])
-        df['Time (H:M)'] = pd.to_datetime(df['Time (s)'], unit='s')
-
-        df.plot(x="Time (H:M)", y=["Volts (mV)"], grid=True, color='Red')  # items to plot
-        plt.gca().xaxis.set_major_formatter(DateFormatter('%H:%M'))
-        plt.title("Time/voltage plot of " + str(sys.argv[2]))
-        plt.savefig("Graph_voltage_" + sys.argv[1] + ".png")  # save as png
-
-        # build and save voltage, Pi wattage, batt%, batt current and batt temp graphs
-        fig, (ax1, ax2, ax3, ax4, ax5) = plt.subplots(nrows=5, ncols=1)
-        df.plot(x="Time (H:M)", y=["Volts (mV)"], legend=True, ax=ax1, figsize=(10, 10), grid=True,
-                color='Red')  # items to plot
-        ax1.xaxis.set_major_formatter(DateFormatter('%H:%M'))
-        ax1.set_title("Time/Voltage plot of " + str(sys.argv[2]))
-
-        df.plot(x="Time (H:M)", y=["Power (mW)"], legend=True, ax=ax2, figsize=(10, 10), grid=True,
-                color='Green')  # items to plot
-        ax2.xaxis.set_major_formatter(DateFormatter('%H:%M'))
-        ax2.set_title("Time/Power plot of " + str(sys.argv[2]))
-
-        df.plot(x="Time (H:M)", y=["Remaining %"], legend=True, ax=ax3, figsize=(10, 10), grid=True,
-                color='Blue')  # items to plot
-        ax3.xaxis.set_major_formatter(DateFormatter('%H:%M'))
-        ax3.set_title("Time/Remaining% plot of " + str(sys.argv[2]))
-
-        df.plot(x="Time (H:M)", y=["Battery Current (mA)"], legend=True, ax=ax4, figsize=(10, 10), grid=True,
-                color='Blue')  # items to plot
-        ax4.xaxis.set_major_formatter(DateFormatter('%H:%M'))
-        ax4.set_title("Time/BattCurrent mA plot of " + str(sys.argv[2]))
-
-        df.plot(x="Time (H:M)", y=["Batt. Temp (ºC)"], legend=True, ax=ax5, figsize=(10, 10), grid=True,
-                color='Blue')  # items to plot
-        ax5.xaxis.set_major_formatter(DateFormatter('%H:%M'))
-        ax5.set_title("Time/BattTempºC plot of " + str(sys.argv[2]))
-
-        plt.tight_layout()
-        plt.savefig("Graphs_full_" + sys.argv[1] + ".png")  # save as png
-
-        print("Graphs saved sucessfully")
-
-    except ImportError:
-        print("Error: Cannot build graph - Pandas and/or matplotlib library not installed.")
-        print("")
-        print(
-            "To install dependancies, use 'pip3 install pandas matplotlib'. If you encounter errors over the Pandas "
-            "dependancy 'numpy', you are probably running Debian Buster on a Pi, and so also need to install OpenBLAS "
-            "('apt-get install libatlas-base-dev")
+csv_file = None  # kept open for the lifetime of the logger
+writer_thread = None  # runs csv_writer(), started by main()
+stop_sent = False  # whether close_file() has queued the writer's stop marker
+pending_rows = []  # formatted rows not yet written to csv_file (writer thread only)
+write_queue = queue.Queue(maxsize=QUEUE_SIZE)  # samples from main() to csv_writer(); None stops it
 
 
 def check_args():
@@ -115,53 +54,124 @@ def check_args():
         sys.exit()
 
     if len(sys.argv) > 2:
+        # imported here so plotting never touches the I2C bus
+        from upsplus_plot import make_graph
         make_graph()
         sys.exit()
 
 
 def create_file():
-    # create csv file and write headers 
-    with open(CSV_FILE, 'x', newline='') as file:
-        writer = csv.writer(file, quoting=csv.QUOTE_NONNUMERIC)
-        csvtitles = [
-            "Time (s)",
-            "Volts (mV)",
-            "Power (mW)",
-            "Remaining %",
-            "Battery Current (mA)",
-            "Batt. Temp (ºC)"]
-        writer.writerow(csvtitles)
-        print(csvtitles)
+    # create csv file, write headers and keep the buffered handle open for main()
+    global csv_file
+    csv_file = open(CSV_FILE, 'x', newline='', buffering=8192)
+    csvtitles = [
+        "Time (s)",
+        "Volts (mV)",
+        "Power (mW)",
+        "Remaining %",
+        "Battery Current (mA)",
+        "Batt. Temp (ºC)"]
+    csv_file.write('"' + '","'.join(csvtitles) + '"\r\n')
+    print(csvtitles)
+
+
+def sync_file():
+    # write pending rows in one go and push them through to the storage device,
+    # so a power cut loses at most FLUSH_EVERY samples
+    csv_file.write("".join(pending_rows))
+    pending_rows.clear()
+    csv_file.flush()
+    os.fsync(csv_file.fileno())
+
+
+def csv_writer():
+    # runs on a daemon thread so SD card stalls don't hold up the next I2C read
+    while True:
+        s = write_queue.get()
+        try:
+            if s is None:
+                sync_file()
+                return
+            # row layout matches the quoted, CRLF-terminated rows csv.writer used to emit
+            row = (f'"{s.time_s}","{s.volts_mv}","{s.power_mw:.0f}","{s.remaining_pct}",'
+                   f'"{s.batt_current_ma:.0f}","{s.batt_temp_c}"\r\n')
+            print(row, end='')
+            pending_rows.append(row)
+            if len(pending_rows) >= FLUSH_EVERY:
+                sync_file()
+        except OSError as e:
+            print("Write error:", e)
+            if s is None:
+                return
+            # keep the rows and retry on the next chunk rather than killing the thread
+
+
+def close_file():
+    # hand the writer thread a stop marker, wait for it to write and sync the rest, then close;
+    # safe to call more than once, including again from atexit after a Ctrl-C cut the first call short
+    global stop_sent
+    if csv_file is None or csv_file.closed:
+        return
+    if writer_thread is not None:
+        if not stop_sent:
+            write_queue.put(None)
+            stop_sent = True
+        writer_thread.join()
+    csv_file.close()
+
+
+atexit.register(close_file)
+
+
+def stop_on_signal(signum, frame):
+    # atexit doesn't run when the process is killed by a signal, so turn SIGTERM (shutdown,
+    # systemctl stop) and SIGHUP into SystemExit; main()'s finally block then saves the pending rows
+    sys.exit(128 + signum)
+
+
+signal.signal(signal.SIGTERM, stop_on_signal)
+signal.signal(signal.SIGHUP, stop_on_signal)
 
 
 def main():
+    global writer_thread
     check_args()
+    # opens the I2C bus and configures the INA219s, so only done once we know we're logging
+    from upsplus_io import read_sample
     create_file()
-    while True:
-        # Loop indefinately whilst reading and writing data, until user hits Ctrl-C 
-        try:
-            a_receive_buf = [0x00]
-            for i in range(1, 255):
-                a_receive_buf.append(bus.read_byte_data(SMB_DEVICE_ADDR, i))
-            csvdata = [
-                "%d" % (a_receive_buf[39] << 24 | a_receive_buf[38] << 16 | a_receive_buf[37] << 8 | a_receive_buf[36]),
-                "%d" % (a_receive_buf[6] << 8 | a_receive_buf[5]),
-                "%.0f" % ina.power(),
-                "%d" % (a_receive_buf[20] << 8 | a_receive_buf[19]),
-                "%.0f" % ina_batteries.current(),
-                "%d" % (a_receive_buf[12] << 8 | a_receive_buf[11])]
-            print(csvdata)
-            with open(CSV_FILE, 'a', newline='') as file:
-                writer = csv.writer(file, quoting=csv.QUOTE_NONNUMERIC)
-                writer.writerow(csvdata)
-            time.sleep(DELAY)
-        except KeyboardInterrupt:
-            sys.exit()
-        except:
-            if STOP_ON_ERR == 1:
-                print("Unexpected error:", sys.exc_info()[0])
-                raise
-            pass
+    writer_thread = threading.Thread(target=csv_writer, daemon=True)
+    writer_thread.start()
+    backoff = DELAY
+    # pace reads against a monotonic deadline so the read/write time doesn't add to DELAY
+    next_tick = time.monotonic()
+    try:
+        while True:
+            # Loop indefinately whilst reading and writing data, until user hits Ctrl-C
+            try:
+                # decoded values are queued as-is; csv_writer() formats them off the sampling thread
+                write_queue.put(read_sample())
+                backoff = DELAY
+                next_tick += DELAY
+                sleep_for = next_tick - time.monotonic()
+                if sleep_for > 0:
+                    time.sleep(sleep_for)
+                else:
+                    print(f"Warning: sample overran DELAY by {-sleep_for:.2f}s, resetting schedule")
+                    next_tick = time.monotonic()
+            except OSError as e:
+                if STOP_ON_ERR == 1:
+                    print("Read error:", e)
+                    raise
+                # back off so a wedged bus isn't hammered every DELAY seconds
+                backoff = min(backoff * 2, MAX_BACKOFF)
+                print(f"Read error: {e}, retrying in {backoff}s")
+                time.sleep(backoff)
+                next_tick = time.monotonic()
+    except KeyboardInterrupt:
+        # caught out here so Ctrl-C during the backoff sleep exits cleanly too
+        sys.exit()
+    finally:
+        close_file()
 
 
 main()